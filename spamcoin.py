@@ -7,8 +7,13 @@ Links:
     https://en.bitcoin.it/wiki/Protocol_documentation
 """
 
-import datetime
+import array
+import concurrent.futures
+import dataclasses
 import hashlib
+import multiprocessing
+import multiprocessing.synchronize
+import struct
 import time
 
 import click
@@ -17,6 +22,30 @@ import click
 # Global log level, modulate via command line argument.
 VERBOSE = False
 
+# Skip the per-block output, modulate via command line argument.
+QUIET = False
+
+# Seconds demo collects per-block output for before writing it out.
+OUT_INTERVAL = 0.5
+
+# Bumped whenever the bytes that go into a block's hash change.
+#   1: every field hashed as its decimal/ISO string
+#   2: nonce hashed as 8 little-endian bytes
+#   3: timestamp hashed as 8 little-endian bytes of nanoseconds since the epoch
+CHAIN_VERSION = 3
+
+# Most leading zero hex digits a 256 bit hash can have.
+MAX_DIFFICULTY = 64
+
+# Fixed width serialization of a block's nonce.
+NONCE_FORMAT = struct.Struct('<Q')
+
+# Number of nonces find_nonce tries between checks of its stop Event.
+NONCE_CHUNK = 1000
+
+# Set in each parallel_find_nonce worker; the Event shared by every lane of the search.
+STOP = None
+
 
 class Block:
     """A very simple block.
@@ -24,42 +53,152 @@ class Block:
     In crypto-currency a block would contain a coinbase record, giving the miner one coin.  This
     serves as incentive to mine, and to make each hashing pool's work unique to them.
     """
-    def __init__(self, height, timestamp, data, previous_hash, nonce):
+    __slots__ = (
+        'height', 'timestamp', 'data', 'previous_hash', 'nonce', 'hash', '_prefix_b',
+    )
+
+    def __init__(self, height, timestamp, data, previous_hash, nonce, digest=None):
         """Construct a block.
 
         Arguments:
             height: where this block is at in the chain
-            timestamp: when this block was created
+            timestamp: when this block was created, in nanoseconds since the epoch
             data: the data to be stored in the block
             previous_hash: a pointer to the previous block's hash
             nonce: [None] A nonce to alter the hash of this block
+            digest: [None] the block's hexdigest, if already known; computed when omitted
         """
         self.height = height
         self.timestamp = timestamp
         self.data = data
         self.previous_hash = previous_hash
         self.nonce = nonce
-        self.hash = self.hash_block()
+
+        # The hashed fields never change for a block, so encode them once.
+        self._prefix_b = self.encode_prefix(height, timestamp, data, previous_hash)
+
+        self.hash = digest if digest is not None else self.hash_block()
 
     def __str__(self):
         return '{}'.format(self.hash)
 
+    @staticmethod
+    def encode_prefix(height, timestamp, data, previous_hash):
+        """Encode everything a block hashes except the nonce.
+
+        This is the one definition of the block hash layout; the miner hashes the same bytes.
+
+        Returns:
+            The bytes to hash ahead of the nonce.
+        """
+        return b''.join((
+            str(height).encode('utf-8'),
+            timestamp.to_bytes(8, 'little'),
+            str(data).encode('utf-8'),
+            str(previous_hash).encode('utf-8'),
+        ))
+
     def hash_block(self):
         """Build the sha256 string for the block.
 
-        The block's hash is based on the it's contents.
+        The block's hash is based on the it's contents.  hashlib is backed by OpenSSL, which checks
+        CPUID at load time and uses the SHA-NI (x86) or SHA2 (ARMv8) instructions when present, so
+        there is no need to carry our own accelerated SHA-256.
 
         Returns:
             A hexdigest of a sha256 hash.
         """
-        sha = hashlib.sha256()
-        sha.update(str(self.height).encode('utf-8'))
-        sha.update(self.timestamp.isoformat().encode('utf-8'))
-        sha.update(str(self.data).encode('utf-8'))
-        sha.update(str(self.previous_hash).encode('utf-8'))
-        sha.update(str(self.nonce).encode('utf-8'))
+        return hashlib.sha256(self._prefix_b + NONCE_FORMAT.pack(self.nonce)).hexdigest()
 
-        return sha.hexdigest()
+
+@dataclasses.dataclass
+class Chain:
+    """The blockchain, stored as a column per Block attribute.
+
+    Columns are preallocated to the full height of the chain.  Heights, nonces and hashes live in
+    packed arrays rather than a list of Block objects, so a long chain costs a few bytes per block
+    and aggregates like the average nonce run over contiguous memory.  Indexing the chain rebuilds
+    a Block for display.
+    """
+    heights: array.array
+    timestamps: array.array
+    data: list
+    nonces: array.array
+    hashes: bytearray
+    length: int = 0
+    version: int = CHAIN_VERSION
+
+    @classmethod
+    def allocate(cls, height):
+        """Build an empty chain with room for the given number of blocks."""
+        return cls(
+            heights=array.array('q', [0]) * height,
+            timestamps=array.array('q', [0]) * height,
+            data=[None] * height,
+            nonces=array.array('q', [0]) * height,
+            hashes=bytearray(32 * height),
+        )
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('chain index out of range')
+
+        previous_hash = self.hashes[32 * (i - 1):32 * i].hex() if i else '0'
+        return Block(self.heights[i], self.timestamps[i], self.data[i], previous_hash,
+                     nonce=self.nonces[i], digest=self.hashes[32 * i:32 * (i + 1)].hex())
+
+    def append_block(self, block):
+        """Write a block into the next free row of the chain.
+
+        A block's previous hash isn't stored; it's read back from the row before.  So only a block
+        that links to the current tail (or to '0', for the genesis block) can be appended.
+
+        Raises:
+            ValueError: if the block's previous hash isn't the tail's hash.
+        """
+        i = self.length
+        tail_hash = self.hashes[32 * (i - 1):32 * i].hex() if i else '0'
+        if block.previous_hash != tail_hash:
+            raise ValueError(
+                'block %s does not link to the chain: previous hash %s, tail hash %s'
+                % (block.height, block.previous_hash, tail_hash))
+
+        self.heights[i] = block.height
+        self.timestamps[i] = block.timestamp
+        self.data[i] = block.data
+        self.nonces[i] = block.nonce
+        self.hashes[32 * i:32 * (i + 1)] = bytes.fromhex(block.hash)
+        self.length += 1
+
+    def validate(self):
+        """Rehash every block and compare it to the stored hash.
+
+        A block's previous hash is read from the row before it, so this checks the links between
+        blocks as well.  The rows are scanned in order over contiguous columns, which leaves nothing
+        for software prefetching to do.
+
+        Hashes from another CHAIN_VERSION were built from a different byte layout, so a chain of
+        another version can't be checked and is rejected outright.
+
+        Returns:
+            True if the chain is this CHAIN_VERSION and every block's hash matches its contents.
+        """
+        if self.version != CHAIN_VERSION:
+            verbose('Chain version %s is not %s.' % (self.version, CHAIN_VERSION))
+            return False
+
+        for i in range(self.length):
+            block = self[i]
+            if block.hash_block() != block.hash:
+                verbose('Block %s does not match its hash.' % i)
+                return False
+
+        return True
 
 
 def create_genesis_block():
@@ -68,66 +207,207 @@ def create_genesis_block():
     Returns:
         A Block instance.
     """
-    return Block(0, datetime.datetime.now(), 'Let there be coin.', '0', nonce=0)
+    return Block(0, time.time_ns(), 'Let there be coin.', '0', nonce=0)
 
 
-def mine_next_block(last_block, difficulty=None):
+def find_nonce(prefix, difficulty, start=0, step=1, stop=None):
+    """Search for the first nonce that satisfies the difficulty.
+
+    Nonces are independent of one another, so the search can be split into lanes: a lane walks
+    start, start + step, start + 2 * step, ...
+
+    Arguments:
+        prefix: the encoded block contents, less the nonce
+        difficulty: [int] the difficulty, number of zeros the hash much start with
+        start: [0] the first nonce to try
+        step: [1] the distance between nonces tried
+        stop: [None] an Event, checked every NONCE_CHUNK nonces, that ends the search when set
+
+    Returns:
+        A (nonce, hexdigest) tuple, or None if stopped before finding one.
+
+    Raises:
+        ValueError: if difficulty is outside 0 to MAX_DIFFICULTY.
+    """
+    if not 0 <= difficulty <= MAX_DIFFICULTY:
+        raise ValueError(
+            'difficulty must be between 0 and %s, not %s' % (MAX_DIFFICULTY, difficulty))
+
+    # Everything but the nonce is fixed for the whole search, so the prefix is hashed once and the
+    # hasher copied for each nonce.  The copy carries the SHA-256 midstate of every full 64 byte
+    # chunk of the prefix, so each nonce only pays for compressing the tail chunk (prefix remainder,
+    # nonce and padding).  The nonce is packed into the same buffer every round.
+    copy = hashlib.sha256(prefix).copy
+    nonce_b = bytearray(NONCE_FORMAT.size)
+    pack_nonce = NONCE_FORMAT.pack_into
+
+    # This is a simple difficulty check, where the new hash must begin with the specified number of
+    # zeros.  Bitcoin requires the zeros plus the hash must be less than the previous block's hash
+    # number.  Leading zero nibbles are the same as the digest, read as a big-endian number, being
+    # no more than a threshold; comparing equal length bytes compares them as exactly that.
+    threshold = ((1 << (256 - 4 * difficulty)) - 1).to_bytes(32, 'big')
+
+    nonce = start
+    while stop is None or not stop.is_set():
+        for nonce in range(nonce, nonce + NONCE_CHUNK * step, step):
+            pack_nonce(nonce_b, 0, nonce)
+            sha = copy()
+            sha.update(nonce_b)
+            digest = sha.digest()
+            if digest <= threshold:
+                return nonce, digest.hex()
+        nonce += step
+        if VERBOSE:  # Don't format the message just to have verbose() drop it.
+            verbose('Searching from nonce %s' % nonce)
+
+    return None
+
+
+@dataclasses.dataclass
+class WorkerPool:
+    """The processes parallel_find_nonce searches with.
+
+    Starting processes costs far more than mining a block at low difficulties, so the pool is
+    started once for a whole chain and the same stop Event is cleared before each search.
+    """
+    executor: concurrent.futures.ProcessPoolExecutor
+    stop: multiprocessing.synchronize.Event
+    size: int
+
+    @classmethod
+    def start(cls, size):
+        """Start the given number of worker processes."""
+        stop = multiprocessing.Event()
+        executor = concurrent.futures.ProcessPoolExecutor(
+            size, initializer=_init_worker, initargs=(stop, VERBOSE))
+        return cls(executor=executor, stop=stop, size=size)
+
+    def shutdown(self):
+        # Lanes only return once stop is set, so set it first or an interrupted search never ends.
+        self.stop.set()
+        self.executor.shutdown()
+
+
+def parallel_find_nonce(prefix, difficulty, pool):
+    """Search for a nonce that satisfies the difficulty across several processes.
+
+    Each worker searches its own lane of the nonce space (worker_id, worker_id + pool.size, ...).
+    The first worker to find a hit sets the pool's stop Event and the others stop at their next
+    check.  The nonce found isn't necessarily the lowest one, only a valid one.
+
+    Arguments:
+        prefix: the encoded block contents, less the nonce
+        difficulty: [int] the difficulty, number of zeros the hash much start with
+        pool: the WorkerPool to search with
+
+    Returns:
+        A (nonce, hexdigest) tuple.
+    """
+    pool.stop.clear()
+    lanes = [
+        pool.executor.submit(_find_nonce_lane, prefix, difficulty, worker_id, pool.size)
+        for worker_id in range(pool.size)
+    ]
+    found = [lane.result() for lane in lanes]
+
+    return min(result for result in found if result is not None)
+
+
+def _init_worker(stop, verbose):
+    global STOP, VERBOSE
+    STOP = stop
+    VERBOSE = verbose
+
+
+def _find_nonce_lane(prefix, difficulty, start, step):
+    found = find_nonce(prefix, difficulty, start=start, step=step, stop=STOP)
+    if found is not None:
+        STOP.set()
+    return found
+
+
+def mine_next_block(last_block, difficulty=None, pool=None):
     """Generate and return the next block in the chain.
 
     Arguments:
         last_block: the last block in the chain to point to
         difficulty: [int] the difficulty, number of zeros the hash much start with
+        pool: [None] a WorkerPool to search for the nonce with, rather than this process
 
     Returns:
         A new Block to be appended to the chain.
     """
     height = last_block.height + 1
-    timestamp = datetime.datetime.now()
+    timestamp = time.time_ns()
     data = 'This is where the block transactions would go.  Height: %s.' % height
 
-    rounds = 0
-    block = Block(height, timestamp, data, last_block.hash, nonce=rounds)
-
     if not difficulty:
-        return block
+        return Block(height, timestamp, data, last_block.hash, nonce=0)
 
-    # This is a simple difficulty check, where the new hash must begin with the specified number of
-    # zeros.  Bitcoin requires the zeros plus the hash must be less than the previous block's hash
-    # number.
-    while not block.hash.startswith('0'*difficulty):  # noqa: E226
-        rounds += 1
-        block = Block(height, timestamp, data, last_block.hash, nonce=rounds)
-        if (rounds % 100) == 0:
-            verbose('%s rounds' % rounds)
+    prefix = Block.encode_prefix(height, timestamp, data, last_block.hash)
+    if pool is not None:
+        nonce, digest = parallel_find_nonce(prefix, difficulty, pool)
+    else:
+        nonce, digest = find_nonce(prefix, difficulty)
 
-    return block
+    # The search only deals in raw nonces and digests; build the one Block that won.
+    return Block(height, timestamp, data, last_block.hash, nonce=nonce, digest=digest)
 
 
-def demo(height=20, difficulty=None):
+def demo(height=20, difficulty=None, workers=1, validate=False):
     """Start a blockchain.
 
     Arguments:
         height: [20] the number of blocks to generate
         difficulty: [None] the number of 0s required at the beginning of the hash
+        workers: [1] the number of processes to mine with
+        validate: [False] rehash the finished chain to check it
     """
-    genesis_block = create_genesis_block()
-    chain = [genesis_block]
+    last_block = create_genesis_block()
+    chain = Chain.allocate(max(height, 1))
+    chain.append_block(last_block)
 
-    start = time.time()
-    for i in range(height - 1):  # Genesis block counts as one.
-        new_block = mine_next_block(chain[-1], difficulty=difficulty)
-        chain.append(new_block)
+    # Writing to the terminal per block dominates at low difficulties, so batch it up.  Flushing
+    # on a timer still shows progress when each block takes a while to mine.
+    batch = []
+    flushed = time.monotonic()
 
-        out('A Block has been added to the blockchain.')
-        out('%s: %s rounds' % (str(new_block), new_block.nonce))
+    start = time.time()
+    pool = WorkerPool.start(workers) if difficulty and workers > 1 else None
+    try:
+        for i in range(height - 1):  # Genesis block counts as one.
+            new_block = mine_next_block(last_block, difficulty=difficulty, pool=pool)
+            chain.append_block(new_block)
+            last_block = new_block
+
+            if QUIET:
+                continue
+
+            batch.append('A Block has been added to the blockchain.')
+            batch.append('%s: nonce %s' % (str(new_block), new_block.nonce))
+            # Verbose progress for the next block prints straight away, so don't hold this one back.
+            if VERBOSE or time.monotonic() - flushed >= OUT_INTERVAL:
+                out('\n'.join(batch))
+                batch = []
+                flushed = time.monotonic()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if batch:
+        out('\n'.join(batch))
 
     end = time.time()
 
-    avg_rounds = sum(block.nonce for block in chain) / len(chain)
+    # With workers the winning nonce comes from one lane, so it isn't a count of hashes tried.
+    avg_nonce = sum(chain.nonces) / len(chain)
 
     out('Created a blockchain with a height of %s.' % len(chain))
     out('Execution time: %ss' % str(round((end - start), 2)))
-    out('Average number of rounds: %s' % str(round(avg_rounds)))
+    out('Average nonce: %s' % str(round(avg_nonce)))
+
+    if validate:
+        out('Chain is %s.' % ('valid' if chain.validate() else 'invalid'))
 
 
 def out(s):
@@ -141,12 +421,18 @@ def verbose(s):
 
 @click.command()
 @click.option('--height', default=20, help='Number of blocks in the chain.', type=int)
-@click.option('--difficulty', default=None, help='Hashing difficulty.', type=int)
+@click.option('--difficulty', default=None, help='Hashing difficulty.',
+              type=click.IntRange(0, MAX_DIFFICULTY))
+@click.option('--workers', default=1, help='Processes to mine with.',
+              type=click.IntRange(1, None))
 @click.option('--verbose', '-v', is_flag=True, default=False, help='Be verbose about it.')
-def cli(height, difficulty, verbose):
-    global VERBOSE
+@click.option('--quiet', '-q', is_flag=True, default=False, help="Don't print each block.")
+@click.option('--validate', is_flag=True, default=False, help='Rehash the chain when done.')
+def cli(height, difficulty, workers, verbose, quiet, validate):
+    global QUIET, VERBOSE
+    QUIET = quiet
     VERBOSE = verbose
-    demo(height=height, difficulty=difficulty)
+    demo(height=height, difficulty=difficulty, workers=workers, validate=validate)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,132 @@
+"""Tests for spamcoin.  Run with `python -m pytest`."""
+
+import hashlib
+
+import pytest
+
+import spamcoin
+
+
+def mine_chain(height, difficulty):
+    """Mine a Chain of the given height without printing anything."""
+    chain = spamcoin.Chain.allocate(height)
+    last_block = spamcoin.create_genesis_block()
+    chain.append_block(last_block)
+    for i in range(height - 1):
+        last_block = spamcoin.mine_next_block(last_block, difficulty=difficulty)
+        chain.append_block(last_block)
+    return chain
+
+
+def test_mined_block_hash_matches_contents():
+    genesis = spamcoin.create_genesis_block()
+    block = spamcoin.mine_next_block(genesis, difficulty=2)
+
+    assert block.hash == block.hash_block()
+    assert block.hash.startswith('00')
+    assert block.previous_hash == genesis.hash
+
+
+def test_chain_indexing_round_trips_blocks():
+    genesis = spamcoin.create_genesis_block()
+    block = spamcoin.mine_next_block(genesis, difficulty=1)
+    chain = spamcoin.Chain.allocate(2)
+    chain.append_block(genesis)
+    chain.append_block(block)
+
+    assert len(chain) == 2
+    for original, stored in ((genesis, chain[0]), (block, chain[-1])):
+        assert stored.height == original.height
+        assert stored.timestamp == original.timestamp
+        assert stored.data == original.data
+        assert stored.previous_hash == original.previous_hash
+        assert stored.nonce == original.nonce
+        assert stored.hash == original.hash
+
+    with pytest.raises(IndexError):
+        chain[2]
+
+
+def test_validate_accepts_mined_chain():
+    assert mine_chain(5, difficulty=1).validate()
+
+
+def test_validate_rejects_edited_nonce():
+    chain = mine_chain(5, difficulty=1)
+    chain.nonces[2] += 1
+
+    assert not chain.validate()
+
+
+def test_validate_rejects_edited_data():
+    chain = mine_chain(5, difficulty=1)
+    chain.data[3] = 'Something else entirely.'
+
+    assert not chain.validate()
+
+
+def test_validate_rejects_edited_hash():
+    # Changing a stored hash breaks the next block's link to it.
+    chain = mine_chain(5, difficulty=1)
+    chain.hashes[32] ^= 0xFF
+
+    assert not chain.validate()
+
+
+def test_block_hash_layout():
+    block = spamcoin.Block(3, 1234567890, 'data', 'ab' * 32, nonce=7)
+    prefix = b'3' + (1234567890).to_bytes(8, 'little') + b'data' + b'ab' * 32
+    expected = hashlib.sha256(prefix + (7).to_bytes(8, 'little')).hexdigest()
+
+    assert block.hash == expected
+
+
+@pytest.mark.parametrize('difficulty', [0, 1, 2, 3])
+def test_find_nonce_matches_leading_hex_zeros(difficulty):
+    # The threshold compare must pick the same first nonce as counting leading hex zeros would.
+    prefix = spamcoin.Block.encode_prefix(1, 1234567890, 'data', '0')
+    nonce, digest = spamcoin.find_nonce(prefix, difficulty)
+
+    def hexdigest(n):
+        return hashlib.sha256(prefix + spamcoin.NONCE_FORMAT.pack(n)).hexdigest()
+
+    assert digest == hexdigest(nonce)
+    assert digest.startswith('0' * difficulty)
+    assert not any(hexdigest(n).startswith('0' * difficulty) for n in range(nonce))
+
+
+@pytest.mark.parametrize('difficulty', [-1, spamcoin.MAX_DIFFICULTY + 1])
+def test_find_nonce_rejects_out_of_range_difficulty(difficulty):
+    with pytest.raises(ValueError):
+        spamcoin.find_nonce(b'prefix', difficulty)
+
+
+def test_parallel_find_nonce_reuses_pool():
+    # The second search relies on the pool's stop Event being cleared after the first.
+    pool = spamcoin.WorkerPool.start(2)
+    try:
+        for data in ('first', 'second'):
+            prefix = spamcoin.Block.encode_prefix(1, 1234567890, data, '0')
+            nonce, digest = spamcoin.parallel_find_nonce(prefix, 3, pool)
+
+            expected = hashlib.sha256(prefix + spamcoin.NONCE_FORMAT.pack(nonce)).hexdigest()
+            assert digest == expected
+            assert digest.startswith('000')
+    finally:
+        pool.shutdown()
+
+
+def test_append_block_rejects_unlinked_block():
+    chain = spamcoin.Chain.allocate(2)
+    chain.append_block(spamcoin.create_genesis_block())
+
+    with pytest.raises(ValueError):
+        chain.append_block(spamcoin.Block(1, 5, 'x', 'not-the-genesis-hash', nonce=0))
+    assert len(chain) == 1
+
+
+def test_validate_rejects_other_chain_version():
+    chain = mine_chain(3, difficulty=1)
+    chain.version = spamcoin.CHAIN_VERSION - 1
+
+    assert not chain.validate()